@@ -16,19 +16,26 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
-from typing import Any, Dict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict
 import asyncio
 import html
 import json
-import logging
+import random
 import re
 import secrets
+import string
+import time
 import uuid
-from urllib.parse import urlparse
 
 import aiohttp
 from aiohttp import web
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from maubot import MessageEvent, Plugin
 from maubot.handlers import command, event, web as web_handler
 from mautrix.types import (
@@ -39,15 +46,60 @@ from mautrix.types import (
     RoomID,
     StateEvent,
     TextMessageEventContent,
+    UserID,
 )
 from mautrix.util.async_db import UpgradeTable
 from mautrix.util.config import BaseProxyConfig, ConfigUpdateHelper
 from mautrix.util.formatter import EntityType, MarkdownString, MatrixParser
 from mautrix.util import markdown
 
-from .db import WebhookDBManager, WebhookRegistration, IncomingWebhook
+from .db import FailedDelivery, WebhookDBManager, WebhookRegistration, is_valid_webhook_url
 from .migrations import upgrade_table
 
+# Retry delays (seconds) for failed deliveries, before jitter is applied
+RETRY_BASE_DELAY = 1
+RETRY_MAX_DELAY = 30
+# Consecutive failed attempts after which a webhook URL is skipped for a while
+BREAKER_THRESHOLD = 5
+BREAKER_MAX_OPEN_TIME = 300
+# Batch senders for webhooks that stopped receiving messages exit after this many seconds
+BATCH_IDLE_TIMEOUT = 300
+# Deliveries that ran out of retries are stored and retried out of band: check for due
+# ones every interval, back off up to the max delay and give up after the max age
+STORED_RETRY_INTERVAL = 60
+STORED_RETRY_MAX_DELAY = 3600
+STORED_RETRY_MAX_AGE = timedelta(hours=24)
+# Only this many bytes of a webhook response are read and echoed back to the room
+MAX_RESPONSE_SIZE = 4096
+
+# Variables available in message_data_template
+MESSAGE_FIELDS = (
+    "event_id",
+    "room_id",
+    "sender",
+    "timestamp",
+    "message_type",
+    "body",
+    "formatted_body",
+    "format",
+)
+
+STATUS_ACTIVE = "🟢 Active"
+STATUS_DISABLED = "🔴 Disabled"
+
+_WEBHOOK_CMD_RE = re.compile(r"\A\s*!webhook(?:\s|$)")
+
+
+def _dumps(data: Any) -> bytes:
+    """Serialize a webhook payload to compact UTF-8 JSON, using orjson when it's installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # orjson doesn't handle every type the config loader can produce
+            pass
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
 
 class HumanReadableString(MarkdownString):
     def format(self, entity_type: EntityType, **kwargs) -> MarkdownString:
@@ -60,6 +112,51 @@ class MaubotHTMLParser(MatrixParser[HumanReadableString]):
     fs = HumanReadableString
 
 
+def _pl(count: int, noun: str) -> str:
+    """Format a count with a singular or plural noun, e.g. "1 webhook" or "3 webhooks"."""
+    return f"{count} {noun}" if count == 1 else f"{count} {noun}s"
+
+
+# Characters that can make markdown or HTML rendering differ from the plain text
+_MARKUP_CHARS = frozenset("*_`#>[]<&~|\\\n")
+
+
+def _is_plain_text(message: str) -> bool:
+    """Check whether a reply renders to exactly its own text, so formatting can be skipped."""
+    if message[:1] in ("-", "+", "=") or message[:1].isdigit():
+        # Could start a list or heading
+        return False
+    return _MARKUP_CHARS.isdisjoint(message)
+
+
+def _compile_template(template: str) -> Callable[[Dict[str, Any]], str]:
+    """Turn a message data template into a function that renders it from the raw message data."""
+    template = str(template)
+    try:
+        parsed = list(string.Formatter().parse(template))
+    except ValueError:
+        # Let the error surface (and get logged) when the template is rendered
+        return template.format_map
+    literal = "".join(part[0] for part in parsed)
+    fields = [part for part in parsed if part[1] is not None]
+    if not fields:
+        # No placeholders (braces may have been escaped), the result is always the same
+        return lambda data: literal
+    if len(fields) == 1:
+        _, field, format_spec, conversion = fields[0]
+        if field.isidentifier() and not format_spec and not conversion:
+            # A single plain "{field}", possibly surrounded by text: concatenating
+            # gives the same result as str.format without parsing the template again
+            index = parsed.index(fields[0])
+            prefix = "".join(part[0] for part in parsed[:index + 1])
+            suffix = "".join(part[0] for part in parsed[index + 1:])
+            if not prefix and not suffix:
+                return lambda data: format(data[field])
+            return lambda data: prefix + format(data[field]) + suffix
+    # Templates with several fields are left to str.format_map, which is implemented in C
+    return template.format_map
+
+
 class Config(BaseProxyConfig):
     def do_update(self, helper: ConfigUpdateHelper) -> None:
         helper.copy("webhook_timeout")
@@ -69,6 +166,10 @@ class Config(BaseProxyConfig):
         helper.copy("custom_fields")
         helper.copy("response_template")
         helper.copy("include_empty_fields")
+        helper.copy("delivery_workers")
+        helper.copy("delivery_queue_size")
+        helper.copy("batch_window_ms")
+        helper.copy("batch_max")
 
     @property
     def webhook_timeout(self) -> int:
@@ -107,10 +208,42 @@ class Config(BaseProxyConfig):
     def include_empty_fields(self) -> bool:
         return self.get("include_empty_fields", False)
 
+    @property
+    def delivery_workers(self) -> int:
+        return self.get("delivery_workers", 16)
+
+    @property
+    def delivery_queue_size(self) -> int:
+        return self.get("delivery_queue_size", 10000)
+
+    @property
+    def batch_window_ms(self) -> int:
+        return self.get("batch_window_ms", 0)
+
+    @property
+    def batch_max(self) -> int:
+        return self.get("batch_max", 50)
+
 
 class WebhookBot(Plugin):
     db: WebhookDBManager
     config: Config
+    _http: aiohttp.ClientSession
+    _parser: MaubotHTMLParser
+    _template_fns: list[tuple[str, Callable[[Dict[str, Any]], str]]]
+    _passthrough: bool
+    _include_empty: bool
+    _custom_fields: Dict[str, Any]
+    _batch_window: float
+    _headers: Dict[str, str]
+    _timeout: aiohttp.ClientTimeout
+    _echo_response: bool
+    _deliver_q: asyncio.Queue[tuple[WebhookRegistration, bytes, aiohttp.BytesPayload, MessageEvent]]
+    _workers: list[asyncio.Task]
+    _breaker: Dict[str, tuple[int, float]]
+    _retry_task: asyncio.Task
+    _batch_queues: Dict[tuple[RoomID, UserID, str], asyncio.Queue[tuple[bytes, MessageEvent]]]
+    _batch_tasks: Dict[tuple[RoomID, UserID, str], asyncio.Task]
 
     @classmethod
     def get_config_class(cls) -> type[BaseProxyConfig]:
@@ -123,10 +256,69 @@ class WebhookBot(Plugin):
     async def start(self) -> None:
         await super().start()
         self.config.load_and_update()
+        self._load_config_cache()
         self.db = WebhookDBManager(self.database)
+        self._parser = MaubotHTMLParser()
+        self._breaker = {}
+        self._batch_queues = {}
+        self._batch_tasks = {}
+        # One shared session for all outgoing deliveries, so connections, DNS lookups
+        # and TLS sessions are reused instead of being set up again for every message.
+        self._http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=100,
+                limit_per_host=10,
+                ttl_dns_cache=300,
+                enable_cleanup_closed=True,
+            ),
+            timeout=self._timeout,
+        )
+        # Deliveries are handed to a fixed pool of workers, so message handling doesn't
+        # wait on slow webhooks and bursts can't spawn an unbounded number of requests.
+        self._deliver_q = asyncio.Queue(maxsize=self.config.delivery_queue_size)
+        self._workers = [
+            asyncio.create_task(self._delivery_worker())
+            for _ in range(max(1, self.config.delivery_workers))
+        ]
+        self._retry_task = asyncio.create_task(self._retry_loop())
 
     async def stop(self) -> None:
+        pending = self._deliver_q.qsize() + sum(q.qsize() for q in self._batch_queues.values())
+        if pending:
+            self.log.warning("Stopping with %s undelivered webhook messages in the queue", pending)
+        tasks = [self._retry_task, *self._batch_tasks.values(), *self._workers]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self._http.close()
         await super().stop()
+
+    def on_external_config_update(self) -> None:
+        super().on_external_config_update()
+        self._load_config_cache()
+
+    def _load_config_cache(self) -> None:
+        """Precompute values derived from the config so they aren't rebuilt for every message."""
+        self._template_fns = [
+            (key, _compile_template(template))
+            for key, template in self.config.message_data_template.items()
+        ]
+        # True when every template just copies the message field of the same name
+        # (the default), in which case the payload is built without rendering templates
+        self._passthrough = all(
+            key in MESSAGE_FIELDS and template == f"{{{key}}}"
+            for key, template in self.config.message_data_template.items()
+        )
+        self._include_empty = self.config.include_empty_fields
+        self._custom_fields = dict(self.config.custom_fields)
+        self._batch_window = self.config.batch_window_ms / 1000
+        self._headers = {
+            "Content-Type": "application/json",
+            "User-Agent": self.config.webhook_user_agent,
+        }
+        self._timeout = aiohttp.ClientTimeout(total=self.config.webhook_timeout)
+        # Webhook responses are only read when the template actually shows them
+        self._echo_response = "{response}" in self.config.response_template
     
     async def _parse_formatted(
         self, message: str, allow_html: bool = True, render_markdown: bool = True
@@ -137,7 +329,7 @@ class WebhookBot(Plugin):
             html_content = message
         else:
             return message, html.escape(message)
-        text = (await MaubotHTMLParser().parse(html_content)).text
+        text = (await self._parser.parse(html_content)).text
         if len(text) > 100 and len(text) + len(html_content) > 40000:
             text = text[:100] + "[long message cut off]"
         return text, html_content
@@ -145,21 +337,22 @@ class WebhookBot(Plugin):
     async def _send_text_reply(self, reply_to: MessageEvent, message: str, allow_html: bool = True, render_markdown: bool = True) -> EventID:
         content = TextMessageEventContent(msgtype=MessageType.TEXT, body=message)
         content.set_reply(reply_to)
-        if render_markdown or allow_html:
+        if (render_markdown or allow_html) and not _is_plain_text(message):
             content.format = Format.HTML
             content.body, content.formatted_body = await self._parse_formatted(message, allow_html=allow_html, render_markdown=render_markdown)
+        else:
+            # Overwrite anything set_reply added, like the formatted path does
+            content.body = message
+            content.format = None
+            content.formatted_body = None
         try:
             return await self.client.send_message_event(reply_to.room_id, EventType.ROOM_MESSAGE, content)
         except Exception as e:
-            self.log.warning(f"Failed to send reply to {reply_to.event_id} in {reply_to.room_id}: {e}")
+            self.log.warning("Failed to send reply to %s in %s: %s", reply_to.event_id, reply_to.room_id, e)
 
     def is_valid_url(self, url: str) -> bool:
         """Validate if the provided URL is a valid HTTP/HTTPS URL."""
-        try:
-            parsed = urlparse(url)
-            return parsed.scheme in ('http', 'https') and bool(parsed.netloc)
-        except Exception:
-            return False
+        return is_valid_webhook_url(url)
 
     def _generate_webhook_id(self) -> str:
         """Generate a unique webhook ID."""
@@ -231,7 +424,7 @@ class WebhookBot(Plugin):
                 content
             )
             
-            self.log.info(f"Message sent via webhook {webhook_id} to room {webhook.room_id}")
+            self.log.info("Message sent via webhook %s to room %s", webhook_id, webhook.room_id)
             
             return web.json_response({
                 "success": True,
@@ -242,7 +435,7 @@ class WebhookBot(Plugin):
         except json.JSONDecodeError:
             return web.json_response({"error": "Invalid JSON in request body"}, status=400)
         except Exception as e:
-            self.log.error(f"Error processing webhook {webhook_id}: {e}")
+            self.log.error("Error processing webhook %s: %s", webhook_id, e)
             return web.json_response({"error": "Internal server error"}, status=500)
 
     @command.new("webhook", help="Webhook management commands")
@@ -279,10 +472,10 @@ class WebhookBot(Plugin):
                 f"All messages in this room will now be forwarded to your webhook."
             )
             
-            self.log.info(f"Webhook registered: {url} for user {evt.sender} in room {evt.room_id}")
+            self.log.info("Webhook registered: %s for user %s in room %s", url, evt.sender, evt.room_id)
             
         except Exception as e:
-            self.log.error(f"Failed to register webhook: {e}")
+            self.log.error("Failed to register webhook: %s", e)
             await self._send_text_reply(evt, f"❌ Failed to register webhook: {str(e)}")
 
     @webhook_command.subcommand("unregister", help="Delete your webhooks")
@@ -298,6 +491,8 @@ class WebhookBot(Plugin):
             if not user_webhooks:
                 await self._send_text_reply(evt, "❌ No webhooks found to delete.")
                 return
+            by_id = {w.id: w for w in user_webhooks}
+            by_url = {w.webhook_url: w for w in user_webhooks}
             
             if not target:
                 # Delete all webhooks for this user
@@ -308,15 +503,15 @@ class WebhookBot(Plugin):
                 
                 if success:
                     count = len(user_webhooks)
-                    await self._send_text_reply(evt, f"✅ {count} webhook{'s' if count != 1 else ''} deleted successfully.")
-                    self.log.info(f"All webhooks deleted for user {evt.sender} in room {evt.room_id}")
+                    await self._send_text_reply(evt, f"✅ {_pl(count, 'webhook')} deleted successfully.")
+                    self.log.info("All webhooks deleted for user %s in room %s", evt.sender, evt.room_id)
                 else:
                     await self._send_text_reply(evt, "❌ Failed to delete webhooks.")
             
             elif target.isdigit():
                 # Delete by webhook ID
                 webhook_id = int(target)
-                webhook = next((w for w in user_webhooks if w.id == webhook_id), None)
+                webhook = by_id.get(webhook_id)
                 
                 if not webhook:
                     await self._send_text_reply(evt, f"❌ No webhook found with ID {webhook_id}.")
@@ -326,13 +521,13 @@ class WebhookBot(Plugin):
                 
                 if success:
                     await self._send_text_reply(evt, f"✅ Webhook ID {webhook_id} deleted successfully.")
-                    self.log.info(f"Webhook ID {webhook_id} deleted for user {evt.sender}")
+                    self.log.info("Webhook ID %s deleted for user %s", webhook_id, evt.sender)
                 else:
                     await self._send_text_reply(evt, f"❌ Failed to delete webhook ID {webhook_id}.")
             
             else:
                 # Delete by URL
-                webhook = next((w for w in user_webhooks if w.webhook_url == target), None)
+                webhook = by_url.get(target)
                 
                 if not webhook:
                     await self._send_text_reply(evt, f"❌ No webhook found with URL: {target}")
@@ -346,12 +541,12 @@ class WebhookBot(Plugin):
                 
                 if success:
                     await self._send_text_reply(evt, f"✅ Webhook deleted successfully: {target}")
-                    self.log.info(f"Webhook URL {target} deleted for user {evt.sender}")
+                    self.log.info("Webhook URL %s deleted for user %s", target, evt.sender)
                 else:
                     await self._send_text_reply(evt, f"❌ Failed to delete webhook: {target}")
                 
         except Exception as e:
-            self.log.error(f"Failed to delete webhook: {e}")
+            self.log.error("Failed to delete webhook: %s", e)
             await self._send_text_reply(evt, f"❌ Failed to delete webhook: {str(e)}")
 
     @webhook_command.subcommand("create", help="Create a new webhook URL endpoint to be used by external services")
@@ -383,10 +578,10 @@ class WebhookBot(Plugin):
                 f"```"
             )
             
-            self.log.info(f"Incoming webhook created: {webhook_id} for user {evt.sender} in room {evt.room_id}")
+            self.log.info("Incoming webhook created: %s for user %s in room %s", webhook_id, evt.sender, evt.room_id)
             
         except Exception as e:
-            self.log.error(f"Failed to create webhook: {e}")
+            self.log.error("Failed to create webhook: %s", e)
             await self._send_text_reply(evt, f"❌ Failed to create webhook: {str(e)}")
 
     @webhook_command.subcommand("delete", help="Delete a webhook URL endpoint")
@@ -417,12 +612,12 @@ class WebhookBot(Plugin):
                 await self._send_text_reply(evt, f"✅ Incoming webhook deleted successfully!\n"
                                 f"**Webhook ID:** `{webhook_id}`\n"
                                 f"The webhook URL is now invalid and cannot be used.")
-                self.log.info(f"Incoming webhook {webhook_id} deleted for user {evt.sender}")
+                self.log.info("Incoming webhook %s deleted for user %s", webhook_id, evt.sender)
             else:
                 await self._send_text_reply(evt, f"❌ Failed to delete webhook `{webhook_id}`.")
                 
         except Exception as e:
-            self.log.error(f"Failed to delete incoming webhook: {e}")
+            self.log.error("Failed to delete incoming webhook: %s", e)
             await self._send_text_reply(evt, f"❌ Failed to delete webhook: {str(e)}")
 
     @webhook_command.subcommand("list", help="List all webhooks in this room")
@@ -437,26 +632,24 @@ class WebhookBot(Plugin):
                 await self._send_text_reply(evt, "You have no webhook in this room.")
                 return
 
-            response = "**Your incoming webhook endpoints:**\n\n"
+            parts = ["**Your incoming webhook endpoints:**\n\n"]
             for webhook in inWebhooks:
                 webhook_url = self._get_webhook_url(webhook.webhook_id)
-                last_used = webhook.last_used.strftime("%Y-%m-%d %H:%M:%S") if webhook.last_used else "Never"
-                
-                response += (
+                parts.append(
                     f"* **ID {webhook.id}:** `{webhook_url} ` - API Key: `{webhook.api_key}`\n\n"
                 )
 
-            response += "**Outgoing webhooks in this room:**\n\n"
+            parts.append("**Outgoing webhooks in this room:**\n\n")
             for webhook in outWebhooks:
-                status = "🟢 Active" if webhook.enabled else "🔴 Disabled"
-                response += (
-                    f"* **ID {webhook.id}:** `{webhook.webhook_url} ({status})`\n\n"
+                parts.append(
+                    f"* **ID {webhook.id}:** `{webhook.webhook_url} "
+                    f"({STATUS_ACTIVE if webhook.enabled else STATUS_DISABLED})`\n\n"
                 )
             
-            await self._send_text_reply(evt, response)
+            await self._send_text_reply(evt, "".join(parts))
             
         except Exception as e:
-            self.log.error(f"Failed to list webhooks: {e}")
+            self.log.error("Failed to list webhooks: %s", e)
             await self._send_text_reply(evt, f"❌ Failed to list webhooks: {str(e)}")
 
     @webhook_command.subcommand("disable", help="Disable your webhooks")
@@ -466,13 +659,14 @@ class WebhookBot(Plugin):
         target = target.strip()
         
         try:
-            # Get user's webhooks first
-            user_webhooks = await self.db.get_webhook_by_room_and_user(evt.room_id, evt.sender)
-            active_webhooks = [w for w in user_webhooks if w.enabled]
+            # Get user's active webhooks first
+            active_webhooks = await self.db.get_enabled_webhooks(evt.room_id, evt.sender)
             
             if not active_webhooks:
                 await self._send_text_reply(evt, "❌ No active webhooks found to disable.")
                 return
+            by_id = {w.id: w for w in active_webhooks}
+            by_url = {w.webhook_url: w for w in active_webhooks}
             
             if not target:
                 # Disable all webhooks for this user
@@ -483,15 +677,15 @@ class WebhookBot(Plugin):
                 
                 if success:
                     count = len(active_webhooks)
-                    await self._send_text_reply(evt, f"✅ {count} webhook{'s' if count != 1 else ''} disabled successfully.")
-                    self.log.info(f"All webhooks disabled for user {evt.sender} in room {evt.room_id}")
+                    await self._send_text_reply(evt, f"✅ {_pl(count, 'webhook')} disabled successfully.")
+                    self.log.info("All webhooks disabled for user %s in room %s", evt.sender, evt.room_id)
                 else:
                     await self._send_text_reply(evt, "❌ Failed to disable webhooks.")
             
             elif target.isdigit():
                 # Disable by webhook ID
                 webhook_id = int(target)
-                webhook = next((w for w in active_webhooks if w.id == webhook_id), None)
+                webhook = by_id.get(webhook_id)
                 
                 if not webhook:
                     await self._send_text_reply(evt, f"❌ No active webhook found with ID {webhook_id}.")
@@ -501,13 +695,13 @@ class WebhookBot(Plugin):
                 
                 if success:
                     await self._send_text_reply(evt, f"✅ Webhook ID {webhook_id} disabled successfully.")
-                    self.log.info(f"Webhook ID {webhook_id} disabled for user {evt.sender}")
+                    self.log.info("Webhook ID %s disabled for user %s", webhook_id, evt.sender)
                 else:
                     await self._send_text_reply(evt, f"❌ Failed to disable webhook ID {webhook_id}.")
             
             else:
                 # Disable by URL
-                webhook = next((w for w in active_webhooks if w.webhook_url == target), None)
+                webhook = by_url.get(target)
                 
                 if not webhook:
                     await self._send_text_reply(evt, f"❌ No active webhook found with URL: {target}")
@@ -521,12 +715,12 @@ class WebhookBot(Plugin):
                 
                 if success:
                     await self._send_text_reply(evt, f"✅ Webhook disabled successfully: {target}")
-                    self.log.info(f"Webhook URL {target} disabled for user {evt.sender}")
+                    self.log.info("Webhook URL %s disabled for user %s", target, evt.sender)
                 else:
                     await self._send_text_reply(evt, f"❌ Failed to disable webhook: {target}")
                 
         except Exception as e:
-            self.log.error(f"Failed to disable webhook: {e}")
+            self.log.error("Failed to disable webhook: %s", e)
             await self._send_text_reply(evt, f"❌ Failed to disable webhook: {str(e)}")
 
     @webhook_command.subcommand("enable", help="Enable your disabled webhooks")
@@ -543,31 +737,24 @@ class WebhookBot(Plugin):
             if not disabled_webhooks:
                 await self._send_text_reply(evt, "❌ No disabled webhooks found to enable.")
                 return
+            by_id = {w.id: w for w in disabled_webhooks}
+            by_url = {w.webhook_url: w for w in disabled_webhooks}
             
             if not target:
-                # Enable all disabled webhooks for this user
-                count = 0
-                for webhook in disabled_webhooks:
-                    success = await self.db.register_webhook(
-                        webhook.room_id,
-                        webhook.user_id,
-                        webhook.webhook_url,
-                        webhook.message_data_template,
-                        webhook_id=webhook.id  # Use existing ID to update
-                    )
-                    if success:
-                        count += 1
+                # Enable all disabled webhooks for this user in one query
+                success = await self.db.enable_webhooks(evt.room_id, evt.sender)
                 
-                if count > 0:
-                    await self._send_text_reply(evt, f"✅ {count} webhook{'s' if count != 1 else ''} enabled successfully.")
-                    self.log.info(f"{count} webhooks enabled for user {evt.sender} in room {evt.room_id}")
+                if success:
+                    count = len(disabled_webhooks)
+                    await self._send_text_reply(evt, f"✅ {_pl(count, 'webhook')} enabled successfully.")
+                    self.log.info("%s webhooks enabled for user %s in room %s", count, evt.sender, evt.room_id)
                 else:
                     await self._send_text_reply(evt, "❌ Failed to enable webhooks.")
             
             elif target.isdigit():
                 # Enable by webhook ID
                 webhook_id = int(target)
-                webhook = next((w for w in disabled_webhooks if w.id == webhook_id), None)
+                webhook = by_id.get(webhook_id)
                 
                 if not webhook:
                     await self._send_text_reply(evt, f"❌ No disabled webhook found with ID {webhook_id}.")
@@ -583,13 +770,13 @@ class WebhookBot(Plugin):
                 
                 if success:
                     await self._send_text_reply(evt, f"✅ Webhook ID {webhook_id} enabled successfully.")
-                    self.log.info(f"Webhook ID {webhook_id} enabled for user {evt.sender}")
+                    self.log.info("Webhook ID %s enabled for user %s", webhook_id, evt.sender)
                 else:
                     await self._send_text_reply(evt, f"❌ Failed to enable webhook ID {webhook_id}.")
             
             else:
                 # Enable by URL
-                webhook = next((w for w in disabled_webhooks if w.webhook_url == target), None)
+                webhook = by_url.get(target)
                 
                 if not webhook:
                     await self._send_text_reply(evt, f"❌ No disabled webhook found with URL: {target}")
@@ -605,12 +792,12 @@ class WebhookBot(Plugin):
                 
                 if success:
                     await self._send_text_reply(evt, f"✅ Webhook enabled successfully: {target}")
-                    self.log.info(f"Webhook URL {target} enabled for user {evt.sender}")
+                    self.log.info("Webhook URL %s enabled for user %s", target, evt.sender)
                 else:
                     await self._send_text_reply(evt, f"❌ Failed to enable webhook: {target}")
                 
         except Exception as e:
-            self.log.error(f"Failed to enable webhook: {e}")
+            self.log.error("Failed to enable webhook: %s", e)
             await self._send_text_reply(evt, f"❌ Failed to enable webhook: {str(e)}")
 
     # @webhook_command.subcommand("configure", help="Configure message data template for a webhook")
@@ -769,10 +956,12 @@ class WebhookBot(Plugin):
             return
 
         # Don't forward command messages
-        if evt.content.msgtype == MessageType.TEXT:
-            text = evt.content.body or ""
-            if text.strip().startswith("!webhook"):
-                return
+        if (
+            evt.content.msgtype == MessageType.TEXT
+            and evt.content.body
+            and _WEBHOOK_CMD_RE.match(evt.content.body)
+        ):
+            return
 
         try:
             webhooks = await self.db.get_webhooks_by_room(evt.room_id)
@@ -781,113 +970,308 @@ class WebhookBot(Plugin):
                 return
 
             # Prepare message data using configurable template
+            # IDs are already str subclasses, templates format every value to a string anyway
+            content = evt.content
+            msgtype = content.msgtype
             raw_data = {
-                "event_id": str(evt.event_id),
-                "room_id": str(evt.room_id),
-                "sender": str(evt.sender),
+                "event_id": evt.event_id,
+                "room_id": evt.room_id,
+                "sender": evt.sender,
                 "timestamp": evt.timestamp,
-                "message_type": str(evt.content.msgtype),
-                "body": evt.content.body,
-                "formatted_body": getattr(evt.content, "formatted_body", None),
-                "format": str(getattr(evt.content, "format", None)) if getattr(evt.content, "format", None) else None,
+                "message_type": msgtype.value if hasattr(msgtype, "value") else msgtype,
+                "body": content.body,
+                "formatted_body": getattr(content, "formatted_body", None),
+                "format": getattr(content, "format", None),
             }
 
             # Build message data using template
-            message_data = {}
-            for key, template in self.config.message_data_template.items():
-                try:
-                    value = template.format(**raw_data)
-                    # Only include field if it has content or if include_empty_fields is True
-                    if self.config.include_empty_fields or (value and value != "None"):
-                        message_data[key] = value
-                except (KeyError, ValueError) as e:
-                    self.log.warning(f"Failed to format template for key '{key}': {e}")
-                    if self.config.include_empty_fields:
-                        message_data[key] = None
+            include_empty = self._include_empty
+            if self._passthrough:
+                message_data = {
+                    key: format(raw_data[key])
+                    for key, _ in self._template_fns
+                    if include_empty or raw_data[key] not in (None, "", "None")
+                }
+            else:
+                message_data = {}
+                for key, render in self._template_fns:
+                    try:
+                        value = render(raw_data)
+                        # Only include field if it has content or if include_empty_fields is True
+                        if include_empty or (value and value != "None"):
+                            message_data[key] = value
+                    except (KeyError, ValueError) as e:
+                        self.log.warning("Failed to format template for key '%s': %s", key, e)
+                        if include_empty:
+                            message_data[key] = None
 
             # Add custom fields
-            message_data.update(self.config.custom_fields)
+            message_data.update(self._custom_fields)
+
+            # The payload is the same for every webhook in the room, so serialize it once
+            body = _dumps(message_data)
+
+            if self._batch_window > 0:
+                for webhook in webhooks:
+                    self._add_to_batch(webhook, body, evt)
+                return
 
-            # Forward to all webhooks in parallel
-            tasks = []
+            # BytesPayload only reads the buffer, so concurrent requests can share it
+            payload = aiohttp.BytesPayload(body, content_type="application/json")
             for webhook in webhooks:
-                task = self._forward_to_webhook(webhook, message_data, evt)
-                tasks.append(task)
-            
-            if tasks:
-                await asyncio.gather(*tasks, return_exceptions=True)
+                self._queue_delivery(webhook, body, payload, evt)
                 
         except Exception as e:
-            self.log.error(f"Error in message forwarding: {e}")
+            self.log.error("Error in message forwarding: %s", e)
+
+    def _queue_delivery(
+        self,
+        webhook: WebhookRegistration,
+        body: bytes,
+        payload: aiohttp.BytesPayload,
+        original_evt: MessageEvent,
+    ) -> None:
+        """Hand a delivery to the worker pool."""
+        try:
+            self._deliver_q.put_nowait((webhook, body, payload, original_evt))
+        except asyncio.QueueFull:
+            self.log.warning(
+                "Delivery queue is full, dropping message %s for webhook %s", original_evt.event_id, webhook.webhook_url
+            )
+
+    def _add_to_batch(self, webhook: WebhookRegistration, body: bytes, evt: MessageEvent) -> None:
+        """Add a message to the pending batch of a webhook, starting its sender if needed."""
+        # Keyed like the table's unique constraint, the id column may be NULL on SQLite
+        key = (webhook.room_id, webhook.user_id, webhook.webhook_url)
+        queue = self._batch_queues.get(key)
+        if queue is None:
+            queue = self._batch_queues[key] = asyncio.Queue(maxsize=self.config.delivery_queue_size)
+            self._batch_tasks[key] = asyncio.create_task(self._batch_sender(webhook, queue))
+        try:
+            queue.put_nowait((body, evt))
+        except asyncio.QueueFull:
+            self.log.warning(
+                "Batch queue is full, dropping message %s for webhook %s", evt.event_id, webhook.webhook_url
+            )
+
+    async def _batch_sender(
+        self,
+        webhook: WebhookRegistration,
+        queue: asyncio.Queue[tuple[bytes, MessageEvent]],
+    ) -> None:
+        """Collect messages for a webhook and queue them as one JSON array per batch window."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                items = [await asyncio.wait_for(queue.get(), timeout=BATCH_IDLE_TIMEOUT)]
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    key = (webhook.room_id, webhook.user_id, webhook.webhook_url)
+                    del self._batch_queues[key]
+                    del self._batch_tasks[key]
+                    return
+                continue
+            deadline = loop.time() + self._batch_window
+            while len(items) < self.config.batch_max:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(queue.get(), timeout=timeout))
+                except asyncio.TimeoutError:
+                    break
+            # The messages are already serialized, so the batch is just their bytes joined
+            body = b"[" + b",".join(item_body for item_body, _ in items) + b"]"
+            payload = aiohttp.BytesPayload(body, content_type="application/json")
+            # Webhook responses are echoed as a reply to the last message of the batch
+            self._queue_delivery(webhook, body, payload, items[-1][1])
+
+    async def _delivery_worker(self) -> None:
+        """Deliver queued messages to webhooks until cancelled."""
+        while True:
+            webhook, body, payload, original_evt = await self._deliver_q.get()
+            try:
+                await self._forward_to_webhook(webhook, body, payload, original_evt)
+            finally:
+                self._deliver_q.task_done()
 
     async def _forward_to_webhook(
         self, 
         webhook: WebhookRegistration, 
-        message_data: Dict[str, Any],
+        body: bytes,
+        payload: aiohttp.BytesPayload,
         original_evt: MessageEvent
     ) -> None:
         """Forward a message to a specific webhook."""
         try:
-            timeout = aiohttp.ClientTimeout(total=self.config.webhook_timeout)
-            
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                headers = {
-                    "Content-Type": "application/json",
-                    "User-Agent": self.config.webhook_user_agent,
-                }
-                
-                for attempt in range(self.config.max_webhook_retries + 1):
-                    try:
-                        async with session.post(
-                            webhook.webhook_url,
-                            json=message_data,
-                            headers=headers,
-                        ) as response:
+            for attempt in range(self.config.max_webhook_retries + 1):
+                if self._breaker_open(webhook.webhook_url):
+                    self.log.debug(
+                        "Skipping webhook %s: too many recent failures", webhook.webhook_url
+                    )
+                    await self._store_failed_delivery(webhook, body, original_evt)
+                    return
+
+                try:
+                    async with self._http.post(
+                        webhook.webhook_url,
+                        data=payload,
+                        headers=self._headers,
+                        timeout=self._timeout,
+                    ) as response:
+                        
+                        if 200 <= response.status < 300:
+                            self._breaker.pop(webhook.webhook_url, None)
+                            # Check if the webhook returned a response to send back
+                            response_text = ""
+                            if self._echo_response and response.content_length != 0:
+                                response_text = await self._read_response(response)
+                            if response_text:
+                                # Send the webhook response back to the chat using template
+                                formatted_response = self.config.response_template.format(response=response_text)
+                                await self._send_text_reply(original_evt, formatted_response)
                             
-                            if response.status == 200:
-                                # Check if the webhook returned a response to send back
-                                try:
-                                    response_text = await response.text()
-                                    if response_text and isinstance(response_text, str):
-                                        # Send the webhook response back to the chat using template
-                                        formatted_response = self.config.response_template.format(response=response_text.strip())
-                                        await self._send_text_reply(original_evt, formatted_response)
-                                            
-                                except (json.JSONDecodeError, KeyError):
-                                    # Webhook didn't return JSON or doesn't have a response field
-                                    pass
-                                
-                                self.log.debug(
-                                    f"Successfully forwarded message to webhook {webhook.webhook_url}"
-                                )
+                            self.log.debug(
+                                "Successfully forwarded message to webhook %s", webhook.webhook_url
+                            )
+                            return
+                        else:
+                            self.log.warning(
+                                "Webhook %s returned status %s", webhook.webhook_url, response.status
+                            )
+                            self._record_failure(webhook.webhook_url)
+                            if 400 <= response.status < 500 and response.status not in (408, 429):
+                                # The webhook rejected the request, sending it again won't help
                                 return
-                            else:
-                                self.log.warning(
-                                    f"Webhook {webhook.webhook_url} returned status {response.status}"
-                                )
-                                
-                    except asyncio.TimeoutError:
-                        self.log.warning(
-                            f"Timeout forwarding to webhook {webhook.webhook_url} (attempt {attempt + 1})"
-                        )
-                    except aiohttp.ClientError as e:
-                        self.log.warning(
-                            f"Client error forwarding to webhook {webhook.webhook_url}: {e} (attempt {attempt + 1})"
-                        )
-                    
-                    if attempt < self.config.max_webhook_retries:
-                        await asyncio.sleep(2 ** attempt)  # Exponential backoff
-                
-                self.log.error(
-                    f"Failed to forward message to webhook {webhook.webhook_url} after {self.config.max_webhook_retries + 1} attempts"
-                )
+                            
+                except asyncio.TimeoutError:
+                    self.log.warning(
+                        "Timeout forwarding to webhook %s (attempt %s)", webhook.webhook_url, attempt + 1
+                    )
+                    self._record_failure(webhook.webhook_url)
+                except aiohttp.ClientError as e:
+                    self.log.warning(
+                        "Client error forwarding to webhook %s: %s (attempt %s)", webhook.webhook_url, e, attempt + 1
+                    )
+                    self._record_failure(webhook.webhook_url)
+                
+                if attempt < self.config.max_webhook_retries and not self._breaker_open(webhook.webhook_url):
+                    await asyncio.sleep(self._retry_delay(attempt))
+            
+            self.log.error(
+                "Failed to forward message to webhook %s after %s attempts",
+                webhook.webhook_url,
+                self.config.max_webhook_retries + 1,
+            )
+            await self._store_failed_delivery(webhook, body, original_evt)
                 
         except Exception as e:
-            self.log.error(f"Unexpected error forwarding to webhook {webhook.webhook_url}: {e}")
+            self.log.error("Unexpected error forwarding to webhook %s: %s", webhook.webhook_url, e)
+
+    async def _store_failed_delivery(
+        self,
+        webhook: WebhookRegistration,
+        body: bytes,
+        original_evt: MessageEvent,
+    ) -> None:
+        """Persist a delivery that couldn't be completed so the retry loop can pick it up."""
+        await self.db.add_failed_delivery(
+            room_id=original_evt.room_id,
+            event_id=original_evt.event_id,
+            webhook_url=webhook.webhook_url,
+            payload=body.decode("utf-8"),
+            next_retry_at=datetime.now() + timedelta(seconds=STORED_RETRY_INTERVAL),
+        )
+
+    async def _retry_loop(self) -> None:
+        """Periodically retry stored deliveries until cancelled."""
+        while True:
+            await asyncio.sleep(STORED_RETRY_INTERVAL)
+            try:
+                await self.db.delete_failed_deliveries_before(datetime.now() - STORED_RETRY_MAX_AGE)
+                deliveries = await self.db.get_due_failed_deliveries(datetime.now())
+            except Exception as e:
+                self.log.error("Error loading stored webhook deliveries: %s", e)
+                continue
+            for delivery in deliveries:
+                # One failing delivery shouldn't hold up the rest of the due ones
+                try:
+                    await self._retry_failed_delivery(delivery)
+                except Exception as e:
+                    self.log.error("Error retrying stored webhook delivery %s: %s", delivery.id, e)
+
+    async def _retry_failed_delivery(self, delivery: FailedDelivery) -> None:
+        """Send a stored delivery again, then delete or reschedule it."""
+        webhooks = await self.db.get_webhooks_by_room(delivery.room_id)
+        if not any(w.webhook_url == delivery.webhook_url for w in webhooks):
+            # The webhook was disabled or deleted in the meantime
+            await self.db.delete_failed_delivery(delivery.id)
+            return
+
+        done = False
+        attempted = not self._breaker_open(delivery.webhook_url)
+        if attempted:
+            try:
+                async with self._http.post(
+                    delivery.webhook_url,
+                    data=delivery.payload.encode("utf-8"),
+                    headers=self._headers,
+                    timeout=self._timeout,
+                ) as response:
+                    if 200 <= response.status < 300:
+                        self._breaker.pop(delivery.webhook_url, None)
+                        done = True
+                    else:
+                        self._record_failure(delivery.webhook_url)
+                        # Don't keep retrying a request the webhook rejected
+                        done = 400 <= response.status < 500 and response.status not in (408, 429)
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                self.log.debug("Retry of stored delivery to webhook %s failed: %s", delivery.webhook_url, e)
+                self._record_failure(delivery.webhook_url)
+
+        if done:
+            self.log.debug("Finished stored delivery of %s to webhook %s", delivery.event_id, delivery.webhook_url)
+            await self.db.delete_failed_delivery(delivery.id)
+        else:
+            # A delivery skipped by the open breaker keeps its place in the backoff schedule
+            attempt_count = delivery.attempt_count + 1 if attempted else delivery.attempt_count
+            delay = min(STORED_RETRY_MAX_DELAY, STORED_RETRY_INTERVAL * 2 ** attempt_count)
+            await self.db.reschedule_failed_delivery(
+                delivery.id, attempt_count, datetime.now() + timedelta(seconds=delay)
+            )
+
+    @staticmethod
+    async def _read_response(response: aiohttp.ClientResponse) -> str:
+        """Read at most MAX_RESPONSE_SIZE bytes of a response body and decode them."""
+        raw = b""
+        while len(raw) < MAX_RESPONSE_SIZE:
+            chunk = await response.content.read(MAX_RESPONSE_SIZE - len(raw))
+            if not chunk:
+                break
+            raw += chunk
+        return raw.decode(response.charset or "utf-8", errors="replace").strip()
+
+    @staticmethod
+    def _retry_delay(attempt: int) -> float:
+        """Exponential backoff with jitter, so retries against one endpoint don't line up."""
+        return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def _breaker_open(self, url: str) -> bool:
+        """Check whether deliveries to a webhook URL are currently being skipped."""
+        state = self._breaker.get(url)
+        return state is not None and time.monotonic() < state[1]
+
+    def _record_failure(self, url: str) -> None:
+        """Count a failed attempt and stop sending to the URL for a while if it keeps failing."""
+        failures = self._breaker.get(url, (0, 0.0))[0] + 1
+        open_until = 0.0
+        if failures >= BREAKER_THRESHOLD:
+            open_until = time.monotonic() + min(BREAKER_MAX_OPEN_TIME, 2 ** failures)
+        self._breaker[url] = (failures, open_until)
 
     @event.on(EventType.ROOM_TOMBSTONE)
     async def tombstone(self, evt: StateEvent) -> None:
         if not evt.content.replacement_room:
             return
         await self.db.update_room_id(evt.room_id, evt.content.replacement_room)
-        self.log.info(f"Updated room ID from {evt.room_id} to {evt.content.replacement_room}")
\ No newline at end of file
+        self.log.info("Updated room ID from %s to %s", evt.room_id, evt.content.replacement_room)
\ No newline at end of file
@@ -16,24 +16,90 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Callable, Dict, Any, Optional
+import asyncio
+import functools
 import json
+import re
+import time
 
 from asyncpg import Record
 from attr import dataclass
 import attr
 
-from mautrix.types import RoomID, UserID
+from mautrix.types import EventID, RoomID, UserID
 from mautrix.util.async_db import Database, Scheme
 
-# TODO make this import unconditional after updating mautrix-python
 try:
-    from mautrix.util.async_db import SQLiteCursor
+    import orjson
 except ImportError:
-    SQLiteCursor = None
+    orjson = None
 
+# How long the active webhooks of a room are cached, as a safety net for changes made
+# to the database without going through WebhookDBManager
+ROOM_CACHE_TTL = 30
 
-@dataclass
+_URL_RE = re.compile(r"\Ahttps?://[^\s/?#]+[^\s]*\Z", re.IGNORECASE)
+
+
+def is_valid_webhook_url(url: str) -> bool:
+    """Check that a URL is an absolute HTTP or HTTPS URL that webhooks can be sent to."""
+    return _URL_RE.match(url) is not None
+
+
+def _json_loads(data: str) -> Any:
+    """Parse a stored JSON value, using orjson when it's installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+@functools.lru_cache(maxsize=2048)
+def _parse_template(data: str) -> Dict[str, str]:
+    """Parse a stored message data template.
+
+    Many rows share the same template, so parsed templates are cached and the same dict
+    is returned for equal strings. Callers must not mutate it.
+    """
+    return _json_loads(data)
+
+
+def _as_datetime(value: datetime | str) -> datetime:
+    """Convert a timestamp column value that may be a datetime or an ISO 8601 string."""
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return datetime.now()
+
+
+def _load_template(data: Optional[str | Dict[str, str]]) -> Optional[Dict[str, str]]:
+    """Parse a stored message data template column, or return None if it's empty or invalid."""
+    # Most webhooks have no template, so check for that before anything else
+    if not data:
+        return None
+    if isinstance(data, dict):
+        # Already decoded by a JSON type codec on the connection
+        return data
+    try:
+        return _parse_template(data)
+    # orjson.JSONDecodeError is a subclass of json.JSONDecodeError
+    except (json.JSONDecodeError, TypeError):
+        return None
+
+
+def _json_dumps(data: Any) -> str:
+    """Serialize a value for a TEXT column, using orjson when it's installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(data)
+
+
+@dataclass(slots=True)
 class WebhookRegistration:
     id: int
     room_id: RoomID
@@ -43,36 +109,38 @@ class WebhookRegistration:
     created_at: datetime = attr.ib(factory=datetime.now)
     message_data_template: Optional[Dict[str, str]] = None
 
+    # Columns are read by position, so queries must select them in the order
+    # id, room_id, user_id, webhook_url, enabled, created_at, message_data_template
+
     @classmethod
     def from_row(cls, row: Record | None) -> WebhookRegistration | None:
         if not row:
             return None
-        
-        created_at = row["created_at"]
-        if not isinstance(created_at, datetime):
-            try:
-                created_at = datetime.fromisoformat(created_at)
-            except ValueError:
-                created_at = datetime.now()
-        
-        # Parse message_data_template from JSON if it exists
-        message_data_template = None
-        if row.get("message_data_template"):
-            try:
-                message_data_template = json.loads(row["message_data_template"])
-            except (json.JSONDecodeError, TypeError):
-                pass  # Use None if parsing fails
-        
+        # The SQLite constructor converts every column, so it's correct for either engine
+        return cls.from_row_sqlite(row)
+
+    @classmethod
+    def from_row_pg(cls, row: Record) -> WebhookRegistration:
+        # asyncpg already returns timestamp columns as datetime objects and booleans as bool
+        return cls(row[0], row[1], row[2], row[3], row[4], row[5], _load_template(row[6]))
+
+    @classmethod
+    def from_row_sqlite(cls, row: Record) -> WebhookRegistration:
+        # SQLite returns booleans as integers. mautrix parses declared timestamp columns
+        # to datetime, but older rows or connections may still yield ISO 8601 strings.
         return cls(
-            id=row["id"],
-            room_id=row["room_id"],
-            user_id=row["user_id"],
-            webhook_url=row["webhook_url"],
-            enabled=bool(row["enabled"]),
-            created_at=created_at,
-            message_data_template=message_data_template,
+            row[0], row[1], row[2], row[3], bool(row[4]), _as_datetime(row[5]), _load_template(row[6])
         )
 
+    @classmethod
+    def from_rows(
+        cls,
+        rows: list[Record],
+        from_row: Optional[Callable[[Record], WebhookRegistration]] = None,
+    ) -> list[WebhookRegistration]:
+        from_row = from_row or cls.from_row
+        return [from_row(row) for row in rows]
+
 
 @dataclass
 class IncomingWebhook:
@@ -116,42 +184,319 @@ class IncomingWebhook:
         )
 
 
+@dataclass
+class FailedDelivery:
+    id: int
+    room_id: RoomID
+    event_id: EventID
+    webhook_url: str
+    payload: str
+    attempt_count: int = 0
+    next_retry_at: datetime = attr.ib(factory=datetime.now)
+    created_at: datetime = attr.ib(factory=datetime.now)
+
+    @classmethod
+    def from_row(cls, row: Record | None) -> FailedDelivery | None:
+        if not row:
+            return None
+        
+        next_retry_at = row["next_retry_at"]
+        if not isinstance(next_retry_at, datetime):
+            try:
+                next_retry_at = datetime.fromisoformat(next_retry_at)
+            except ValueError:
+                next_retry_at = datetime.now()
+        
+        created_at = row["created_at"]
+        if not isinstance(created_at, datetime):
+            try:
+                created_at = datetime.fromisoformat(created_at)
+            except ValueError:
+                created_at = datetime.now()
+        
+        return cls(
+            id=row["id"],
+            room_id=row["room_id"],
+            event_id=row["event_id"],
+            webhook_url=row["webhook_url"],
+            payload=row["payload"],
+            attempt_count=row["attempt_count"],
+            next_retry_at=next_retry_at,
+            created_at=created_at,
+        )
+
+
+# The queries are module-level constants so every call passes identical SQL text, which
+# asyncpg's per-connection statement cache prepares once and then reuses.
+
+# webhook_registration queries. Columns are selected in the order WebhookRegistration
+# reads them by position.
+_Q_GET_BY_ROOM = """
+SELECT id, room_id, user_id, webhook_url, enabled, created_at, message_data_template
+FROM webhook_registration
+WHERE room_id = $1 AND enabled = true
+"""
+
+_Q_GET_ENABLED_BY_ROOM_USER = """
+SELECT id, room_id, user_id, webhook_url, enabled, created_at, message_data_template
+FROM webhook_registration
+WHERE room_id = $1 AND enabled = true AND user_id = $2
+ORDER BY created_at DESC
+"""
+
+_Q_GET_BY_ROOM_USER = """
+SELECT id, room_id, user_id, webhook_url, enabled, created_at, message_data_template
+FROM webhook_registration
+WHERE room_id = $1 AND user_id = $2
+ORDER BY created_at DESC
+"""
+
+_Q_GET_BY_ID = """
+SELECT id, room_id, user_id, webhook_url, enabled, created_at, message_data_template
+FROM webhook_registration
+WHERE id = $1
+"""
+
+_Q_ENABLE_BY_ID = """
+UPDATE webhook_registration
+SET enabled = true, message_data_template = $3
+WHERE id = $1 AND user_id = $2
+RETURNING room_id, webhook_url, created_at
+"""
+
+_Q_UPSERT = """
+INSERT INTO webhook_registration (room_id, user_id, webhook_url, enabled, created_at, message_data_template)
+VALUES ($1, $2, $3, true, $4, $5)
+ON CONFLICT (room_id, user_id, webhook_url)
+DO UPDATE SET enabled = true, message_data_template = excluded.message_data_template
+RETURNING id, created_at
+"""
+
+_Q_DISABLE_BY_URL = """
+UPDATE webhook_registration
+SET enabled = false
+WHERE room_id = $1 AND user_id = $2 AND webhook_url = $3
+"""
+
+_Q_DISABLE_BY_USER = """
+UPDATE webhook_registration
+SET enabled = false
+WHERE room_id = $1 AND user_id = $2
+"""
+
+_Q_ENABLE_BY_USER = """
+UPDATE webhook_registration
+SET enabled = true
+WHERE room_id = $1 AND user_id = $2 AND enabled = false
+RETURNING room_id
+"""
+
+_Q_DISABLE_BY_ID = """
+UPDATE webhook_registration
+SET enabled = false
+WHERE id = $1 AND user_id = $2
+RETURNING room_id
+"""
+
+_Q_LIST_BY_ROOM = """
+SELECT id, room_id, user_id, webhook_url, enabled, created_at, message_data_template
+FROM webhook_registration
+WHERE room_id = $1
+ORDER BY id ASC
+"""
+
+_Q_UPDATE_TEMPLATE = """
+UPDATE webhook_registration
+SET message_data_template = $3
+WHERE id = $1 AND user_id = $2
+RETURNING room_id
+"""
+
+_Q_UPDATE_TEMPLATES = """
+UPDATE webhook_registration
+SET message_data_template = $3
+WHERE id = $1 AND user_id = $2
+"""
+
+_Q_DELETE_BY_URL = """
+DELETE FROM webhook_registration
+WHERE room_id = $1 AND user_id = $2 AND webhook_url = $3
+"""
+
+_Q_DELETE_BY_USER = """
+DELETE FROM webhook_registration
+WHERE room_id = $1 AND user_id = $2
+"""
+
+_Q_DELETE_BY_ID = """
+DELETE FROM webhook_registration
+WHERE id = $1 AND user_id = $2
+RETURNING room_id
+"""
+
+_Q_MOVE_ROOM_REGISTRATIONS = "UPDATE webhook_registration SET room_id = $1 WHERE room_id = $2"
+
+# incoming_webhook queries
+_Q_INSERT_INCOMING = """
+INSERT INTO incoming_webhook (room_id, user_id, webhook_id, api_key, enabled, created_at)
+VALUES ($1, $2, $3, $4, true, $5)
+RETURNING id
+"""
+
+_Q_GET_INCOMING_BY_WEBHOOK_ID = """
+SELECT id, room_id, user_id, webhook_id, api_key, enabled, created_at, last_used
+FROM incoming_webhook
+WHERE webhook_id = $1 AND enabled = true
+"""
+
+_Q_GET_INCOMING_BY_USER = """
+SELECT id, room_id, user_id, webhook_id, api_key, enabled, created_at, last_used
+FROM incoming_webhook
+WHERE room_id = $1 AND user_id = $2
+ORDER BY created_at DESC
+"""
+
+_Q_GET_INCOMING_BY_ID = """
+SELECT id, room_id, user_id, webhook_id, api_key, enabled, created_at, last_used
+FROM incoming_webhook
+WHERE id = $1 AND user_id = $2
+"""
+
+_Q_DELETE_INCOMING = """
+DELETE FROM incoming_webhook
+WHERE id = $1 AND user_id = $2
+"""
+
+_Q_UPDATE_INCOMING_LAST_USED = """
+UPDATE incoming_webhook
+SET last_used = $2
+WHERE webhook_id = $1
+"""
+
+_Q_VALIDATE_INCOMING = """
+SELECT id, room_id, user_id, webhook_id, api_key, enabled, created_at, last_used
+FROM incoming_webhook
+WHERE webhook_id = $1 AND api_key = $2 AND enabled = true
+"""
+
+# webhook_delivery_attempt queries
+_Q_INSERT_DELIVERY = """
+INSERT INTO webhook_delivery_attempt
+    (room_id, event_id, webhook_url, payload, attempt_count, next_retry_at, created_at)
+VALUES ($1, $2, $3, $4, 0, $5, $6)
+"""
+
+_Q_GET_DUE_DELIVERIES = """
+SELECT id, room_id, event_id, webhook_url, payload, attempt_count, next_retry_at, created_at
+FROM webhook_delivery_attempt
+WHERE next_retry_at <= $1
+ORDER BY next_retry_at ASC
+LIMIT $2
+"""
+
+_Q_RESCHEDULE_DELIVERY = """
+UPDATE webhook_delivery_attempt
+SET attempt_count = $2, next_retry_at = $3
+WHERE id = $1
+"""
+
+_Q_MOVE_ROOM_DELIVERIES = "UPDATE webhook_delivery_attempt SET room_id = $1 WHERE room_id = $2"
+
+_Q_DELETE_DELIVERY = "DELETE FROM webhook_delivery_attempt WHERE id = $1"
+
+_Q_DELETE_DELIVERIES_BEFORE = "DELETE FROM webhook_delivery_attempt WHERE created_at < $1"
+
+
 class WebhookDBManager:
     db: Database
+    _room_cache: Dict[RoomID, tuple[float, list[WebhookRegistration]]]
+    _room_loading: Dict[RoomID, asyncio.Future]
+    _row_ctor: Callable[[Record], WebhookRegistration]
 
     def __init__(self, db: Database) -> None:
         self.db = db
+        # The column types only depend on the database engine, so pick the matching
+        # row constructor once instead of checking types for every row
+        if db.scheme == Scheme.SQLITE:
+            self._row_ctor = WebhookRegistration.from_row_sqlite
+        else:
+            self._row_ctor = WebhookRegistration.from_row_pg
+        self._room_cache = {}
+        self._room_loading = {}
+
+    def _invalidate_room(self, *room_ids: RoomID) -> None:
+        """Drop the cached webhook list of rooms whose registrations changed."""
+        for room_id in room_ids:
+            self._room_cache.pop(room_id, None)
+            self._room_loading.pop(room_id, None)
+
+    def _match_any(self, column: str, index: int, values: list) -> tuple[str, list]:
+        """Build a condition matching any of the values, with parameters starting at $index."""
+        if self.db.scheme == Scheme.SQLITE:
+            # SQLite has no array parameters, so use one parameter per value
+            placeholders = ", ".join(f"${i}" for i in range(index, index + len(values)))
+            return f"{column} IN ({placeholders})", list(values)
+        return f"{column} = ANY(${index})", [list(values)]
 
     async def get_webhooks_by_room(self, room_id: RoomID) -> list[WebhookRegistration]:
-        """Get all active webhook registrations for a room."""
-        q = """
-        SELECT id, room_id, user_id, webhook_url, enabled, created_at, message_data_template
-        FROM webhook_registration 
-        WHERE room_id = $1 AND enabled = true
+        """Get all active webhook registrations for a room.
+
+        This runs for every message, so results are cached in memory until a write
+        through this class changes the room's registrations or the TTL expires.
+        The returned list is shared and must not be mutated.
         """
-        rows = await self.db.fetch(q, room_id)
-        return [WebhookRegistration.from_row(row) for row in rows if row]
+        cached = self._room_cache.get(room_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        # Concurrent messages to an uncached room share a single database query
+        fut = self._room_loading.get(room_id)
+        if fut is not None:
+            # Shielded so a cancelled waiter doesn't cancel the lookup for everyone else
+            return await asyncio.shield(fut)
+        fut = asyncio.get_running_loop().create_future()
+        self._room_loading[room_id] = fut
+        try:
+            webhooks = await self._fetch_webhooks_by_room(room_id)
+        except Exception as e:
+            fut.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting
+            fut.exception()
+            raise
+        else:
+            fut.set_result(webhooks)
+            # Don't cache the result if the room was invalidated while it was loading
+            if self._room_loading.get(room_id) is fut:
+                self._room_cache[room_id] = (time.monotonic() + ROOM_CACHE_TTL, webhooks)
+            return webhooks
+        finally:
+            if not fut.done():
+                # The lookup itself was cancelled, don't leave the other waiters hanging
+                fut.cancel()
+            if self._room_loading.get(room_id) is fut:
+                del self._room_loading[room_id]
+
+    async def _fetch_webhooks_by_room(self, room_id: RoomID) -> list[WebhookRegistration]:
+        rows = await self.db.fetch(_Q_GET_BY_ROOM, room_id)
+        return WebhookRegistration.from_rows(rows, self._row_ctor)
+
+    async def get_enabled_webhooks(
+        self, room_id: RoomID, user_id: Optional[UserID] = None
+    ) -> list[WebhookRegistration]:
+        """Get the active webhook registrations for a room, optionally only those of one user."""
+        if user_id is None:
+            return await self.get_webhooks_by_room(room_id)
+        rows = await self.db.fetch(_Q_GET_ENABLED_BY_ROOM_USER, room_id, user_id)
+        return WebhookRegistration.from_rows(rows, self._row_ctor)
 
     async def get_webhook_by_room_and_user(self, room_id: RoomID, user_id: UserID) -> list[WebhookRegistration]:
         """Get all webhook registrations for a specific room and user."""
-        q = """
-        SELECT id, room_id, user_id, webhook_url, enabled, created_at, message_data_template
-        FROM webhook_registration 
-        WHERE room_id = $1 AND user_id = $2
-        ORDER BY created_at DESC
-        """
-        rows = await self.db.fetch(q, room_id, user_id)
-        return [WebhookRegistration.from_row(row) for row in rows if row]
+        rows = await self.db.fetch(_Q_GET_BY_ROOM_USER, room_id, user_id)
+        return WebhookRegistration.from_rows(rows, self._row_ctor)
 
     async def get_webhook_by_id(self, webhook_id: int) -> WebhookRegistration | None:
         """Get a specific webhook by ID."""
-        q = """
-        SELECT id, room_id, user_id, webhook_url, enabled, created_at, message_data_template
-        FROM webhook_registration 
-        WHERE id = $1
-        """
-        row = await self.db.fetchrow(q, webhook_id)
-        return WebhookRegistration.from_row(row)
+        row = await self.db.fetchrow(_Q_GET_BY_ID, webhook_id)
+        return self._row_ctor(row) if row else None
 
     async def register_webhook(
         self,
@@ -161,119 +506,156 @@ class WebhookDBManager:
         message_data_template: Optional[Dict[str, str]] = None,
         webhook_id: Optional[int] = None,
     ) -> WebhookRegistration:
-        """Register a new webhook or enable an existing one by ID."""
+        """Register a new webhook or enable an existing one by ID.
+
+        Raises ValueError if a new webhook URL isn't a valid HTTP or HTTPS URL.
+        """
         # Convert template to JSON string for storage
-        template_json = json.dumps(message_data_template) if message_data_template else None
+        template_json = _json_dumps(message_data_template) if message_data_template else None
         
         if webhook_id:
             # Enable existing webhook by ID
-            update_q = """
-            UPDATE webhook_registration 
-            SET enabled = true, message_data_template = $3
-            WHERE id = $1 AND user_id = $2
-            RETURNING id, room_id, user_id, webhook_url, enabled, created_at, message_data_template
-            """
-            row = await self.db.fetchrow(update_q, webhook_id, user_id, template_json)
-            return WebhookRegistration.from_row(row)
-        
-        # Check if this exact URL already exists for this user in this room
-        existing_q = """
-        SELECT id, room_id, user_id, webhook_url, enabled, created_at, message_data_template
-        FROM webhook_registration 
-        WHERE room_id = $1 AND user_id = $2 AND webhook_url = $3
-        """
-        existing_row = await self.db.fetchrow(existing_q, room_id, user_id, webhook_url)
+            row = await self.db.fetchrow(_Q_ENABLE_BY_ID, webhook_id, user_id, template_json)
+            if not row:
+                return None
+            self._invalidate_room(row["room_id"])
+            return WebhookRegistration(
+                id=webhook_id,
+                room_id=row["room_id"],
+                user_id=user_id,
+                webhook_url=row["webhook_url"],
+                enabled=True,
+                created_at=_as_datetime(row["created_at"]),
+                message_data_template=message_data_template or None,
+            )
         
-        if existing_row:
-            # Update existing webhook (enable it and update template)
-            update_q = """
-            UPDATE webhook_registration 
-            SET enabled = true, message_data_template = $4
-            WHERE room_id = $1 AND user_id = $2 AND webhook_url = $3
-            RETURNING id, room_id, user_id, webhook_url, enabled, created_at, message_data_template
-            """
-            row = await self.db.fetchrow(update_q, room_id, user_id, webhook_url, template_json)
-            return WebhookRegistration.from_row(row)
-        else:
-            # Create new webhook registration
-            insert_q = """
-            INSERT INTO webhook_registration (room_id, user_id, webhook_url, enabled, created_at, message_data_template)
-            VALUES ($1, $2, $3, true, $4, $5)
-            RETURNING id, room_id, user_id, webhook_url, enabled, created_at, message_data_template
-            """
-            created_at = datetime.now()
-            
-            # Handle SQLite differently since it may not support RETURNING
-            if self.db.scheme == Scheme.SQLITE:
-                sqlite_insert_q = """
-                INSERT INTO webhook_registration (room_id, user_id, webhook_url, enabled, created_at, message_data_template)
-                VALUES ($1, $2, $3, true, $4, $5)
-                """
-                cur = await self.db.execute(sqlite_insert_q, room_id, user_id, webhook_url, created_at, template_json)
-                
-                if SQLiteCursor is not None:
-                    assert isinstance(cur, SQLiteCursor)
-                webhook_id = cur.lastrowid
-                
-                return WebhookRegistration(
-                    id=webhook_id,
-                    room_id=room_id,
-                    user_id=user_id,
-                    webhook_url=webhook_url,
-                    enabled=True,
-                    created_at=created_at,
-                    message_data_template=message_data_template,
-                )
-            else:
-                row = await self.db.fetchrow(insert_q, room_id, user_id, webhook_url, created_at, template_json)
-                return WebhookRegistration.from_row(row)
+        if not is_valid_webhook_url(webhook_url):
+            raise ValueError(f"Invalid webhook URL: {webhook_url}")
+
+        # Create the registration, or re-enable it and update the template if this
+        # exact URL already exists for this user in this room
+        row = await self.db.fetchrow(_Q_UPSERT, room_id, user_id, webhook_url, datetime.now(), template_json)
+        self._invalidate_room(room_id)
+        # Everything else is known already, so don't parse the template back from the row
+        return WebhookRegistration(
+            id=row["id"],
+            room_id=room_id,
+            user_id=user_id,
+            webhook_url=webhook_url,
+            enabled=True,
+            created_at=_as_datetime(row["created_at"]),
+            message_data_template=message_data_template or None,
+        )
 
     async def unregister_webhook(self, room_id: RoomID, user_id: UserID, webhook_url: str = None) -> bool:
         """Disable a specific webhook registration, or all webhooks for a user if webhook_url is None."""
         if webhook_url:
-            q = """
-            UPDATE webhook_registration 
-            SET enabled = false
-            WHERE room_id = $1 AND user_id = $2 AND webhook_url = $3
-            """
-            result = await self.db.execute(q, room_id, user_id, webhook_url)
+            result = await self.db.execute(_Q_DISABLE_BY_URL, room_id, user_id, webhook_url)
         else:
-            q = """
-            UPDATE webhook_registration 
-            SET enabled = false
-            WHERE room_id = $1 AND user_id = $2
-            """
-            result = await self.db.execute(q, room_id, user_id)
+            result = await self.db.execute(_Q_DISABLE_BY_USER, room_id, user_id)
         
+        self._invalidate_room(room_id)
         return result != "UPDATE 0"
 
+    async def enable_webhooks(self, room_id: RoomID, user_id: UserID) -> bool:
+        """Enable all disabled webhook registrations of a user in a room."""
+        rows = await self.db.fetch(_Q_ENABLE_BY_USER, room_id, user_id)
+        self._invalidate_room(room_id)
+        return len(rows) > 0
+
+    async def bulk_unregister(
+        self, entries: list[tuple[RoomID, UserID, Optional[str]]]
+    ) -> list[bool]:
+        """Disable several webhook registrations with a single query.
+
+        Each entry is a (room_id, user_id, webhook_url) tuple like the arguments of
+        unregister_webhook, where a webhook_url of None disables all of the user's
+        webhooks in the room. Returns whether anything was disabled for each entry.
+        """
+        if not entries:
+            return []
+        with_url = []
+        without_url = []
+        args = []
+        for room_id, user_id, webhook_url in entries:
+            i = len(args) + 1
+            if webhook_url:
+                with_url.append(f"(${i}, ${i + 1}, ${i + 2})")
+                args += (room_id, user_id, webhook_url)
+            else:
+                without_url.append(f"(${i}, ${i + 1})")
+                args += (room_id, user_id)
+        conds = []
+        if with_url:
+            conds.append(f"(room_id, user_id, webhook_url) IN ({', '.join(with_url)})")
+        if without_url:
+            conds.append(f"(room_id, user_id) IN ({', '.join(without_url)})")
+        q = f"""
+        UPDATE webhook_registration 
+        SET enabled = false
+        WHERE {" OR ".join(conds)}
+        RETURNING room_id, user_id, webhook_url
+        """
+        rows = await self.db.fetch(q, *args)
+        self._invalidate_room(*{row["room_id"] for row in rows})
+        changed = {(row["room_id"], row["user_id"], row["webhook_url"]) for row in rows}
+        changed_users = {(room_id, user_id) for room_id, user_id, _ in changed}
+        return [
+            (room_id, user_id, webhook_url) in changed
+            if webhook_url else (room_id, user_id) in changed_users
+            for room_id, user_id, webhook_url in entries
+        ]
+
     async def unregister_webhook_by_id(self, webhook_id: int, user_id: UserID) -> bool:
         """Disable a webhook registration by ID, but only if it belongs to the user."""
-        q = """
+        row = await self.db.fetchrow(_Q_DISABLE_BY_ID, webhook_id, user_id)
+        if not row:
+            return False
+        self._invalidate_room(row["room_id"])
+        return True
+
+    async def bulk_set_enabled(self, ids: list[int], user_id: UserID, enabled: bool) -> bool:
+        """Enable or disable several webhooks of a user with a single query."""
+        if not ids:
+            return False
+        id_cond, id_args = self._match_any("id", 3, ids)
+        q = f"""
         UPDATE webhook_registration 
-        SET enabled = false
-        WHERE id = $1 AND user_id = $2
+        SET enabled = $1
+        WHERE user_id = $2 AND {id_cond}
+        RETURNING room_id
         """
-        result = await self.db.execute(q, webhook_id, user_id)
-        return result != "UPDATE 0"
+        rows = await self.db.fetch(q, enabled, user_id, *id_args)
+        self._invalidate_room(*{row["room_id"] for row in rows})
+        return len(rows) > 0
 
     async def list_webhooks_for_room(self, room_id: RoomID) -> list[WebhookRegistration]:
         """List all webhook registrations (enabled and disabled) for a room."""
-        q = """
+        rows = await self.db.fetch(_Q_LIST_BY_ROOM, room_id)
+        return WebhookRegistration.from_rows(rows, self._row_ctor)
+
+    async def list_webhooks_for_rooms(self, room_ids: list[RoomID]) -> Dict[RoomID, list[WebhookRegistration]]:
+        """List all webhook registrations (enabled and disabled) for several rooms with a single query."""
+        result: Dict[RoomID, list[WebhookRegistration]] = {room_id: [] for room_id in room_ids}
+        if not room_ids:
+            return result
+        room_cond, room_args = self._match_any("room_id", 1, room_ids)
+        q = f"""
         SELECT id, room_id, user_id, webhook_url, enabled, created_at, message_data_template
         FROM webhook_registration 
-        WHERE room_id = $1
-        ORDER BY id ASC
+        WHERE {room_cond}
+        ORDER BY room_id, id ASC
         """
-        rows = await self.db.fetch(q, room_id)
-        return [WebhookRegistration.from_row(row) for row in rows if row]
+        rows = await self.db.fetch(q, *room_args)
+        for row in rows:
+            result[row["room_id"]].append(self._row_ctor(row))
+        return result
 
     async def update_room_id(self, old: RoomID, new: RoomID) -> None:
         """Update room ID when a room is upgraded."""
-        await self.db.execute(
-            "UPDATE webhook_registration SET room_id = $1 WHERE room_id = $2", 
-            new, old
-        )
+        await self.db.execute(_Q_MOVE_ROOM_REGISTRATIONS, new, old)
+        await self.db.execute(_Q_MOVE_ROOM_DELIVERIES, new, old)
+        self._invalidate_room(old, new)
 
     async def update_message_template(
         self,
@@ -282,15 +664,42 @@ class WebhookDBManager:
         message_data_template: Optional[Dict[str, str]],
     ) -> bool:
         """Update the message data template for a specific webhook."""
-        template_json = json.dumps(message_data_template) if message_data_template else None
+        template_json = _json_dumps(message_data_template) if message_data_template else None
         
-        q = """
-        UPDATE webhook_registration 
-        SET message_data_template = $3
-        WHERE id = $1 AND user_id = $2
+        row = await self.db.fetchrow(_Q_UPDATE_TEMPLATE, webhook_id, user_id, template_json)
+        if not row:
+            return False
+        self._invalidate_room(row["room_id"])
+        return True
+
+    async def update_message_templates(
+        self, updates: list[tuple[int, UserID, Optional[Dict[str, str]]]]
+    ) -> None:
+        """Update the message data templates of several webhooks in one batch.
+
+        Each update is a (webhook_id, user_id, message_data_template) tuple like the
+        arguments of update_message_template.
         """
-        result = await self.db.execute(q, webhook_id, user_id, template_json)
-        return result != "UPDATE 0"
+        if not updates:
+            return
+        await self.db.executemany(
+            _Q_UPDATE_TEMPLATES,
+            [
+                (webhook_id, user_id, _json_dumps(template) if template else None)
+                for webhook_id, user_id, template in updates
+            ],
+        )
+        # executemany doesn't report which rows changed, so drop every cached room
+        # containing one of the webhooks. Only enabled webhooks are cached, so rooms
+        # that aren't cached have nothing stale in memory.
+        ids = {webhook_id for webhook_id, _, _ in updates}
+        self._invalidate_room(*[
+            room_id
+            for room_id, (_, webhooks) in self._room_cache.items()
+            if any(webhook.id in ids for webhook in webhooks)
+        ])
+        # Lookups that were already running may have read the old templates
+        self._room_loading.clear()
 
     async def delete_webhook(
         self,
@@ -301,19 +710,12 @@ class WebhookDBManager:
         """Delete webhook(s) from the database."""
         if webhook_url:
             # Delete specific webhook by URL
-            q = """
-            DELETE FROM webhook_registration 
-            WHERE room_id = $1 AND user_id = $2 AND webhook_url = $3
-            """
-            result = await self.db.execute(q, room_id, user_id, webhook_url)
+            result = await self.db.execute(_Q_DELETE_BY_URL, room_id, user_id, webhook_url)
         else:
             # Delete all webhooks for user in room
-            q = """
-            DELETE FROM webhook_registration 
-            WHERE room_id = $1 AND user_id = $2
-            """
-            result = await self.db.execute(q, room_id, user_id)
+            result = await self.db.execute(_Q_DELETE_BY_USER, room_id, user_id)
         
+        self._invalidate_room(room_id)
         return result != "DELETE 0"
 
     async def delete_webhook_by_id(
@@ -322,12 +724,25 @@ class WebhookDBManager:
         user_id: UserID,
     ) -> bool:
         """Delete a specific webhook by ID (with user verification)."""
-        q = """
+        row = await self.db.fetchrow(_Q_DELETE_BY_ID, webhook_id, user_id)
+        if not row:
+            return False
+        self._invalidate_room(row["room_id"])
+        return True
+
+    async def delete_webhooks_by_ids(self, ids: list[int], user_id: UserID) -> bool:
+        """Delete several webhooks of a user with a single query."""
+        if not ids:
+            return False
+        id_cond, id_args = self._match_any("id", 2, ids)
+        q = f"""
         DELETE FROM webhook_registration 
-        WHERE id = $1 AND user_id = $2
+        WHERE user_id = $1 AND {id_cond}
+        RETURNING room_id
         """
-        result = await self.db.execute(q, webhook_id, user_id)
-        return result != "DELETE 0"
+        rows = await self.db.fetch(q, user_id, *id_args)
+        self._invalidate_room(*{row["room_id"] for row in rows})
+        return len(rows) > 0
 
     # Incoming webhook methods
     async def create_incoming_webhook(
@@ -340,94 +755,73 @@ class WebhookDBManager:
         """Create a new incoming webhook endpoint."""
         created_at = datetime.now()
         
-        insert_q = """
-        INSERT INTO incoming_webhook (room_id, user_id, webhook_id, api_key, enabled, created_at)
-        VALUES ($1, $2, $3, $4, true, $5)
-        RETURNING id, room_id, user_id, webhook_id, api_key, enabled, created_at, last_used
-        """
-        
-        # Handle SQLite differently since it may not support RETURNING
-        if self.db.scheme == Scheme.SQLITE:
-            sqlite_insert_q = """
-            INSERT INTO incoming_webhook (room_id, user_id, webhook_id, api_key, enabled, created_at)
-            VALUES ($1, $2, $3, $4, true, $5)
-            """
-            cur = await self.db.execute(sqlite_insert_q, room_id, user_id, webhook_id, api_key, created_at)
-            
-            if SQLiteCursor is not None:
-                assert isinstance(cur, SQLiteCursor)
-            id = cur.lastrowid
-            
-            return IncomingWebhook(
-                id=id,
-                room_id=room_id,
-                user_id=user_id,
-                webhook_id=webhook_id,
-                api_key=api_key,
-                enabled=True,
-                created_at=created_at,
-                last_used=None,
-            )
-        else:
-            row = await self.db.fetchrow(insert_q, room_id, user_id, webhook_id, api_key, created_at)
-            return IncomingWebhook.from_row(row)
+        row = await self.db.fetchrow(_Q_INSERT_INCOMING, room_id, user_id, webhook_id, api_key, created_at)
+        return IncomingWebhook(
+            id=row["id"],
+            room_id=room_id,
+            user_id=user_id,
+            webhook_id=webhook_id,
+            api_key=api_key,
+            enabled=True,
+            created_at=created_at,
+            last_used=None,
+        )
 
     async def get_incoming_webhook_by_id(self, webhook_id: str) -> IncomingWebhook | None:
         """Get an incoming webhook by webhook_id."""
-        q = """
-        SELECT id, room_id, user_id, webhook_id, api_key, enabled, created_at, last_used
-        FROM incoming_webhook 
-        WHERE webhook_id = $1 AND enabled = true
-        """
-        row = await self.db.fetchrow(q, webhook_id)
+        row = await self.db.fetchrow(_Q_GET_INCOMING_BY_WEBHOOK_ID, webhook_id)
         return IncomingWebhook.from_row(row)
 
     async def get_incoming_webhooks_by_user(self, room_id: RoomID, user_id: UserID) -> list[IncomingWebhook]:
         """Get all incoming webhooks for a user in a room."""
-        q = """
-        SELECT id, room_id, user_id, webhook_id, api_key, enabled, created_at, last_used
-        FROM incoming_webhook 
-        WHERE room_id = $1 AND user_id = $2
-        ORDER BY created_at DESC
-        """
-        rows = await self.db.fetch(q, room_id, user_id)
-        return [IncomingWebhook.from_row(row) for row in rows if row]
+        rows = await self.db.fetch(_Q_GET_INCOMING_BY_USER, room_id, user_id)
+        return [IncomingWebhook.from_row(row) for row in rows]
     
     async def get_incoming_webhooks_by_id(self, id: int, user_id: UserID) -> IncomingWebhook | None:
         """Get an incoming webhook by its internal ID."""
-        q = """
-        SELECT id, room_id, user_id, webhook_id, api_key, enabled, created_at, last_used
-        FROM incoming_webhook 
-        WHERE id = $1 AND user_id = $2
-        """
-        row = await self.db.fetchrow(q, id, user_id)
+        row = await self.db.fetchrow(_Q_GET_INCOMING_BY_ID, id, user_id)
         return IncomingWebhook.from_row(row)
 
     async def delete_incoming_webhook(self, id: int, user_id: UserID) -> bool:
         """Delete an incoming webhook by its internal ID (with user verification)."""
-        q = """
-        DELETE FROM incoming_webhook 
-        WHERE id = $1 AND user_id = $2
-        """
-        result = await self.db.execute(q, id, user_id)
+        result = await self.db.execute(_Q_DELETE_INCOMING, id, user_id)
         return result != "DELETE 0"
 
     async def update_incoming_webhook_last_used(self, webhook_id: str) -> bool:
         """Update the last_used timestamp for an incoming webhook."""
-        q = """
-        UPDATE incoming_webhook 
-        SET last_used = $2
-        WHERE webhook_id = $1
-        """
-        result = await self.db.execute(q, webhook_id, datetime.now())
+        result = await self.db.execute(_Q_UPDATE_INCOMING_LAST_USED, webhook_id, datetime.now())
         return result != "UPDATE 0"
 
     async def validate_incoming_webhook(self, webhook_id: str, api_key: str) -> IncomingWebhook | None:
         """Validate an incoming webhook by webhook_id and api_key."""
-        q = """
-        SELECT id, room_id, user_id, webhook_id, api_key, enabled, created_at, last_used
-        FROM incoming_webhook 
-        WHERE webhook_id = $1 AND api_key = $2 AND enabled = true
-        """
-        row = await self.db.fetchrow(q, webhook_id, api_key)
-        return IncomingWebhook.from_row(row)
\ No newline at end of file
+        row = await self.db.fetchrow(_Q_VALIDATE_INCOMING, webhook_id, api_key)
+        return IncomingWebhook.from_row(row)
+
+    # Failed delivery methods
+    async def add_failed_delivery(
+        self,
+        room_id: RoomID,
+        event_id: EventID,
+        webhook_url: str,
+        payload: str,
+        next_retry_at: datetime,
+    ) -> None:
+        """Store a delivery that ran out of retries so it can be retried later."""
+        await self.db.execute(_Q_INSERT_DELIVERY, room_id, event_id, webhook_url, payload, next_retry_at, datetime.now())
+
+    async def get_due_failed_deliveries(self, now: datetime, limit: int = 100) -> list[FailedDelivery]:
+        """Get stored deliveries whose next retry is due, oldest first."""
+        rows = await self.db.fetch(_Q_GET_DUE_DELIVERIES, now, limit)
+        return [FailedDelivery.from_row(row) for row in rows]
+
+    async def reschedule_failed_delivery(self, id: int, attempt_count: int, next_retry_at: datetime) -> None:
+        """Record another failed attempt for a stored delivery."""
+        await self.db.execute(_Q_RESCHEDULE_DELIVERY, id, attempt_count, next_retry_at)
+
+    async def delete_failed_delivery(self, id: int) -> None:
+        """Delete a stored delivery after it succeeded or was given up."""
+        await self.db.execute(_Q_DELETE_DELIVERY, id)
+
+    async def delete_failed_deliveries_before(self, created_before: datetime) -> None:
+        """Drop stored deliveries that are too old to be worth retrying."""
+        await self.db.execute(_Q_DELETE_DELIVERIES_BEFORE, created_before)
@@ -52,4 +52,125 @@ async def upgrade_v2(conn: Connection, scheme: Scheme) -> None:
             PRIMARY KEY (id),
             UNIQUE (room_id, user_id, webhook_id)
         )"""
-    )
\ No newline at end of file
+    )
+
+
+@upgrade_table.register(description="Create table for failed outgoing webhook deliveries", upgrades_to=3)
+async def upgrade_v3(conn: Connection, scheme: Scheme) -> None:
+    await conn.execute(
+        f"""CREATE TABLE IF NOT EXISTS webhook_delivery_attempt (
+            id            SERIAL,
+            room_id       TEXT NOT NULL,
+            event_id      TEXT NOT NULL,
+            webhook_url   TEXT NOT NULL,
+            payload       TEXT NOT NULL,
+            attempt_count INTEGER NOT NULL DEFAULT 0,
+            next_retry_at timestamp NOT NULL,
+            created_at    timestamp NOT NULL,
+
+            PRIMARY KEY (id)
+        )"""
+    )
+
+
+@upgrade_table.register(description="Add index for looking up active webhooks by room", upgrades_to=4)
+async def upgrade_v4(conn: Connection, scheme: Scheme) -> None:
+    # Lookups by room and user are already covered by the UNIQUE (room_id, user_id, webhook_url) index
+    if scheme == Scheme.SQLITE:
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS webhook_reg_room_idx ON webhook_registration (room_id)"
+        )
+    else:
+        await conn.execute(
+            """CREATE INDEX IF NOT EXISTS webhook_reg_room_enabled_idx
+            ON webhook_registration (room_id) WHERE enabled = true"""
+        )
+
+
+@upgrade_table.register(description="Store message data templates as JSONB on Postgres", upgrades_to=5)
+async def upgrade_v5(conn: Connection, scheme: Scheme) -> None:
+    # SQLite has no native JSON type, so templates stay in the TEXT column there
+    if scheme == Scheme.SQLITE:
+        return
+    await conn.execute(
+        """ALTER TABLE webhook_registration
+        ALTER COLUMN message_data_template TYPE JSONB
+        USING message_data_template::jsonb"""
+    )
+
+
+@upgrade_table.register(description="Use real integer primary keys on SQLite", upgrades_to=6)
+async def upgrade_v6(conn: Connection, scheme: Scheme) -> None:
+    # SERIAL isn't an integer type to SQLite, so the id columns weren't rowid aliases and
+    # were left NULL. Rebuild the tables with INTEGER PRIMARY KEY ids, giving existing
+    # rows their rowid as id.
+    if scheme != Scheme.SQLITE:
+        return
+    await conn.execute(
+        """CREATE TABLE webhook_registration_new (
+            id          INTEGER PRIMARY KEY,
+            room_id     TEXT NOT NULL,
+            user_id     TEXT NOT NULL,
+            webhook_url TEXT NOT NULL,
+            enabled     BOOLEAN DEFAULT true,
+            created_at  timestamp NOT NULL,
+            message_data_template TEXT,
+
+            UNIQUE (room_id, user_id, webhook_url)
+        )"""
+    )
+    await conn.execute(
+        """INSERT INTO webhook_registration_new
+            (id, room_id, user_id, webhook_url, enabled, created_at, message_data_template)
+        SELECT COALESCE(id, rowid), room_id, user_id, webhook_url, enabled, created_at, message_data_template
+        FROM webhook_registration"""
+    )
+    await conn.execute("DROP TABLE webhook_registration")
+    await conn.execute("ALTER TABLE webhook_registration_new RENAME TO webhook_registration")
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS webhook_reg_room_idx ON webhook_registration (room_id)"
+    )
+
+    await conn.execute(
+        """CREATE TABLE incoming_webhook_new (
+            id          INTEGER PRIMARY KEY,
+            room_id     TEXT NOT NULL,
+            user_id     TEXT NOT NULL,
+            webhook_id  TEXT NOT NULL UNIQUE,
+            api_key     TEXT NOT NULL UNIQUE,
+            enabled     BOOLEAN DEFAULT true,
+            created_at  timestamp NOT NULL,
+            last_used   timestamp,
+
+            UNIQUE (room_id, user_id, webhook_id)
+        )"""
+    )
+    await conn.execute(
+        """INSERT INTO incoming_webhook_new
+            (id, room_id, user_id, webhook_id, api_key, enabled, created_at, last_used)
+        SELECT COALESCE(id, rowid), room_id, user_id, webhook_id, api_key, enabled, created_at, last_used
+        FROM incoming_webhook"""
+    )
+    await conn.execute("DROP TABLE incoming_webhook")
+    await conn.execute("ALTER TABLE incoming_webhook_new RENAME TO incoming_webhook")
+
+    await conn.execute(
+        """CREATE TABLE webhook_delivery_attempt_new (
+            id            INTEGER PRIMARY KEY,
+            room_id       TEXT NOT NULL,
+            event_id      TEXT NOT NULL,
+            webhook_url   TEXT NOT NULL,
+            payload       TEXT NOT NULL,
+            attempt_count INTEGER NOT NULL DEFAULT 0,
+            next_retry_at timestamp NOT NULL,
+            created_at    timestamp NOT NULL
+        )"""
+    )
+    await conn.execute(
+        """INSERT INTO webhook_delivery_attempt_new
+            (id, room_id, event_id, webhook_url, payload, attempt_count, next_retry_at, created_at)
+        SELECT COALESCE(id, rowid), room_id, event_id, webhook_url, payload, attempt_count, next_retry_at, created_at
+        FROM webhook_delivery_attempt"""
+    )
+    await conn.execute("DROP TABLE webhook_delivery_attempt")
+    await conn.execute("ALTER TABLE webhook_delivery_attempt_new RENAME TO webhook_delivery_attempt")